@@ -1,188 +1,525 @@
+import asyncio
+import functools
+import json
 import os
+import re
+import httpx
+from dataclasses import dataclass
+from typing import Annotated, Callable, Optional
 from crewai import Agent, Task, Crew, Process
 from crewai_tools import tool
-from pydantic import BaseModel, Field
+from pydantic import Field, TypeAdapter, ValidationError
 from google import genai
-from google.generativeai.errors import APIError
+from google.genai import types
+from google.genai.errors import APIError, ServerError
+from google.api_core.exceptions import GoogleAPIError
 from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
-# Load environment variables (for GEMINI_API_KEY)
-load_dotenv()
+try:
+    import diskcache
+except ImportError:  # Optional: persistent cross-process cache for market data
+    diskcache = None
 
 # --- 1. A2A Communication Schemas (Pydantic) ---
-# This ensures structured data handoff between the Profiler and Market Analyst
-class UserProfile(BaseModel):
+# This ensures structured data handoff between the Profiler and Market Analyst.
+# Plain dataclasses validated through module-level TypeAdapters; the field
+# descriptions end up in the JSON schemas the agents are prompted with.
+@dataclass
+class UserProfile:
     """Structured data defining the user's current status and goals."""
-    current_skills: str = Field(description="Comma-separated list of the user's current professional skills.")
-    target_role: str = Field(description="The exact job title the user is aiming for (e.g., Senior Data Scientist).")
-    years_of_experience: int = Field(description="Total years of professional experience.")
+    current_skills: Annotated[str, Field(description="Comma-separated list of the user's current professional skills.")]
+    target_role: Annotated[str, Field(description="The exact job title the user is aiming for (e.g., Senior Data Scientist).")]
+    years_of_experience: Annotated[int, Field(description="Total years of professional experience.")]
 
-class MarketAnalysis(BaseModel):
+@dataclass
+class MarketAnalysis:
     """Structured data defining the market gap found by the Analyst."""
-    required_skills_found: str = Field(description="Comma-separated list of mandatory skills found in job postings for the target role.")
-    critical_skill_gap: str = Field(description="The most important 1-3 skills the user is missing based on current market data.")
-    average_salary_range: str = Field(description="The current typical salary range for the target role.")
+    required_skills_found: Annotated[str, Field(description="Comma-separated list of mandatory skills found in job postings for the target role.")]
+    critical_skill_gap: Annotated[str, Field(description="The most important 1-3 skills the user is missing based on current market data.")]
+    average_salary_range: Annotated[str, Field(description="The current typical salary range for the target role.")]
+
+# Built once and reused for every profile
+USER_PROFILE_ADAPTER = TypeAdapter(UserProfile)
+MARKET_ANALYSIS_ADAPTER = TypeAdapter(MarketAnalysis)
+USER_PROFILE_SCHEMA_JSON = json.dumps(USER_PROFILE_ADAPTER.json_schema())
+MARKET_ANALYSIS_SCHEMA_JSON = json.dumps(MARKET_ANALYSIS_ADAPTER.json_schema())
 
 # --- 2. Tool Definition (Dynamic Tool Use) ---
 # NOTE: In a real-world scenario, this tool would use a specialized API (like Google Search)
 # for real-time data. Here, we simulate the function call structure.
 
+# Market data is a pure function of the (normalised) role, so lookups are memoised
+# in-process and, when `diskcache` is installed, persisted across runs for a day.
+MARKET_CACHE_DIR = "./.market_cache"
+MARKET_CACHE_TTL = 24 * 60 * 60
+
+# Simulated market data keyed on the normalised role
+MARKET_DATA = {
+    "data analyst": (
+        "Market Data: The primary mandatory skills for a Junior Data Analyst are: "
+        "Advanced SQL, Tableau Visualization, and Python (Pandas/NumPy). "
+        "Secondary skills include basic cloud proficiency (AWS/Azure). "
+        "Typical salary range in major US metro areas is $75,000 - $95,000."
+    ),
+    "software engineer": (
+        "Market Data: Mandatory skills for a Mid-Level Software Engineer are: "
+        "Expertise in Python/GoLang, proficiency in Docker/Kubernetes, and AWS/GCP services. "
+        "Typical salary range is $120,000 - $160,000."
+    ),
+}
+DEFAULT_MARKET_DATA = "Market Data: No specific data found. General requirements: excellent communication, problem-solving, and continuous learning."
+
+def _fetch_market_data(role_key: str) -> str:
+    print(f"\n--- TOOL ACTIVATED: Searching live market data for {role_key} ---")
+    # Exact roles hit the dict directly; titles such as "junior data analyst" fall back to a substring match
+    key = role_key if role_key in MARKET_DATA else next(
+        (known_role for known_role in MARKET_DATA if known_role in role_key), None
+    )
+    return MARKET_DATA.get(key, DEFAULT_MARKET_DATA)
+
+@functools.lru_cache(maxsize=None)
+def _market_cache():
+    return diskcache.Cache(MARKET_CACHE_DIR)
+
+@functools.lru_cache(maxsize=1024)
+def _lookup_market_data(role_key: str) -> str:
+    if diskcache is None:
+        return _fetch_market_data(role_key)
+    result = _market_cache().get(role_key)
+    if result is None:
+        result = _fetch_market_data(role_key)
+        _market_cache().set(role_key, result, expire=MARKET_CACHE_TTL)
+    return result
+
 @tool("Google Search Market Data")
 def google_search_market_data(target_role: str) -> str:
     """
     Analyzes current Q4 2025 job postings and market trends for a specified job title.
     Returns the required hard skills and salary expectations.
     """
-    print(f"\n--- TOOL ACTIVATED: Searching live market data for {target_role} ---")
-    
-    # Simulation based on target role
-    if "Data Analyst" in target_role:
-        return (
-            "Market Data: The primary mandatory skills for a Junior Data Analyst are: "
-            "Advanced SQL, Tableau Visualization, and Python (Pandas/NumPy). "
-            "Secondary skills include basic cloud proficiency (AWS/Azure). "
-            "Typical salary range in major US metro areas is $75,000 - $95,000."
-        )
-    elif "Software Engineer" in target_role:
-        return (
-            "Market Data: Mandatory skills for a Mid-Level Software Engineer are: "
-            "Expertise in Python/GoLang, proficiency in Docker/Kubernetes, and AWS/GCP services. "
-            "Typical salary range is $120,000 - $160,000."
-        )
-    else:
-        return "Market Data: No specific data found. General requirements: excellent communication, problem-solving, and continuous learning."
+    # Normalise so "Junior Data Analyst " and "junior data analyst" share a cache slot
+    return _lookup_market_data(target_role.strip().lower())
 
 # --- 3. Agent Definitions ---
 
 # Shared Configuration
-llm = genai.Client(model="gemini-2.5-flash-preview-09-2025")
-# The LLM must be passed to the agents when using the Google GenAI library
-
-# 3.1. Profiler Agent (The Interviewer)
-profiler_agent = Agent(
-    role='Career Profiler',
-    goal="""Engage the user to accurately gather their current skills, experience, and specific career goals.
-            Structure the raw input into a perfect, validated JSON format using the provided Pydantic Schema.
-            Your output MUST be a valid JSON object matching the UserProfile schema.""",
-    backstory="A specialized HR consultant focused on deep, conversational skill elicitation. You manage the session context and ensure zero ambiguity in user data.",
-    llm=llm,
-    verbose=True,
-    allow_delegation=False,
-)
+GEMINI_MODEL = "gemini-2.5-flash-preview-09-2025"
+
+@functools.lru_cache(maxsize=None)
+def get_client() -> genai.Client:
+    """Shared Gemini client, created on first use so importing this module stays cheap."""
+    return genai.Client(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        # One pooled connection set, reused by the direct (streamed) requests
+        http_options=types.HttpOptions(
+            async_client_args={
+                "limits": httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            },
+        ),
+    )
+
+@functools.lru_cache(maxsize=None)
+def gemini_slots() -> asyncio.Semaphore:
+    """Shared limiter for crew runs and direct Gemini requests.
+
+    Sized by GEMINI_MAX_CONCURRENCY, defaulting to MAX_PARALLEL_CREWS.
+    """
+    return asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", MAX_PARALLEL_CREWS)))
+
+# The LLM must be passed to the agents when using the Google GenAI library.
+# CrewAI binds stop words onto it (`llm.bind(stop=...)`), so agents need the
+# LangChain chat model rather than the bare genai.Client.
+@functools.lru_cache(maxsize=None)
+def get_agent_llm() -> ChatGoogleGenerativeAI:
+    """Shared LangChain chat model for every agent, created on first use."""
+    return ChatGoogleGenerativeAI(model=GEMINI_MODEL, google_api_key=os.getenv("GEMINI_API_KEY"))
+
+# 3.1. Profiler Agent (The Interviewer) - only used when the user input is incomplete
+def build_profiler_agent() -> Agent:
+    return Agent(
+        role='Career Profiler',
+        goal="Structure the user's skills, experience and target role as UserProfile JSON.",
+        backstory="An HR consultant who turns loose user data into clean profiles.",
+        llm=get_agent_llm(),
+        verbose=True,
+        allow_delegation=False,
+    )
 
 # 3.2. Market Analyst Agent (The Data Scientist)
-market_analyst = Agent(
-    role='Real-Time Market Analyst',
-    goal="""Receive the structured user profile. Use the 'Google Search Market Data' tool to fetch current job requirements and salary.
-            Perform a critical skill-gap analysis by comparing the user's skills against the market requirements.
-            Your final output MUST be a valid JSON object matching the MarketAnalysis schema.""",
-    backstory="A data scientist focused purely on objective market data. You use external tools to validate job requirements and identify high-value skill gaps.",
-    tools=[google_search_market_data],
-    llm=llm,
-    verbose=True,
-    allow_delegation=False,
-)
+def build_market_analyst() -> Agent:
+    return Agent(
+        role='Real-Time Market Analyst',
+        goal="Fetch market data for the target role and return the user's skill gap as MarketAnalysis JSON.",
+        backstory="A data scientist who relies only on objective market data.",
+        tools=[google_search_market_data],
+        llm=get_agent_llm(),
+        verbose=True,
+        allow_delegation=False,
+    )
 
-# 3.3. Strategist Agent (The Career Coach)
-strategist_agent = Agent(
-    role='Career Strategy Coach',
-    goal="""Synthesize the Skill Gap Analysis into a structured, motivational, and actionable Career Roadmap Report.
-            The report MUST include a Skill Gap Analysis Summary, a clear Action Plan, and specific, high-value resource recommendations.
-            Do not output JSON; output a well-formatted Markdown report.""",
-    backstory="""A seasoned career coach with access to a wide internal Knowledge Base of highly-rated courses (Simulated Memory). 
-                 You bridge the gap between data and action, providing concrete steps.""",
-    # Simulate Long-Term Memory (Knowledge Base) in the system prompt
-    system_prompt="""You are the world's best career coach. You have access to the following top-tier resources (your Knowledge Base):
-                 - SQL/Data Warehousing: 'Advanced SQL Mastery for Data Science' (Certification)
-                 - Visualization: 'Tableau Desktop Specialist Training' (Course)
-                 - Cloud Basics: 'AWS Certified Cloud Practitioner Basics' (Certification)
-                 - Programming: 'Python Data Structures & Algorithms Refresher' (Course)
-                 Use these specific names when recommending resources to the user.""",
-    llm=llm,
-    verbose=True,
-    allow_delegation=False,
+# 3.3. Strategist (The Career Coach)
+# Prompted directly through the Gemini client instead of a CrewAI agent so its
+# report can be streamed to the user as it is generated.
+STRATEGIST_INSTRUCTION = (
+    "You are a Career Strategy Coach who turns skill gaps into concrete plans and courses. "
+    "Turn the skill gap analysis into a concise, actionable Markdown career roadmap."
 )
 
+# 3.4. Combined Analyst + Strategist Agent - one LLM call instead of two for complete profiles
+def build_combined_agent() -> Agent:
+    return Agent(
+        role='Career Market Strategist',
+        goal="Analyse the user's market skill gap, then turn it into a concise Markdown career roadmap.",
+        backstory="A data-driven career coach who checks market data before advising.",
+        tools=[google_search_market_data],
+        llm=get_agent_llm(),
+        verbose=True,
+        allow_delegation=False,
+    )
+
 # --- 4. Task Definitions (The Workflow) ---
 
 # --- USER INPUT ---
-# NOTE: Change these inputs to test different scenarios
-USER_CURRENT_SKILLS = "Python, basic Excel, strong theoretical statistics, good communication."
-USER_TARGET_ROLE = "Junior Data Analyst"
-USER_EXPERIENCE = 2
+# NOTE: Add or change profiles to test different scenarios; all of them run as one batch
+USER_PROFILES = [
+    {
+        "current_skills": "Python, basic Excel, strong theoretical statistics, good communication.",
+        "target_role": "Junior Data Analyst",
+        "years_of_experience": 2,
+    },
+]
+# Crews kicked off at once; keeps bursts under the Gemini rate limit
+MAX_PARALLEL_CREWS = 3
+# Complete profiles get their analysis and report from one combined agent call.
+# Off by default: the fused report cannot be streamed, only printed once finished.
+FUSE_ANALYST_STRATEGIST = False
 # --------------------
 
-task_profiler = Task(
-    description=f"""
-    Conduct an internal interview based on the following raw user data:
-    - Skills: {USER_CURRENT_SKILLS}
-    - Target Role: {USER_TARGET_ROLE}
-    - Experience: {USER_EXPERIENCE} years.
-    Your task is to structure this data into the required JSON format ({UserProfile.schema_json()}).
-    """,
-    agent=profiler_agent,
-    output_json=UserProfile,
-    expected_output="A single, valid JSON object matching the UserProfile schema."
-)
+# Simulated Long-Term Memory (Knowledge Base): skill keyword -> resource.
+# Only the entries matching the Analyst's skill gap are sent to the Strategist.
+KNOWLEDGE_BASE = {
+    "sql": "Advanced SQL Mastery for Data Science (Certification)",
+    "visualization": "Tableau Desktop Specialist Training (Course)",
+    "tableau": "Tableau Desktop Specialist Training (Course)",
+    "cloud": "AWS Certified Cloud Practitioner Basics (Certification)",
+    "aws": "AWS Certified Cloud Practitioner Basics (Certification)",
+    "python": "Python Data Structures & Algorithms Refresher (Course)",
+}
 
-task_analyst = Task(
-    description="""
-    Execute the following steps sequentially:
-    1. Receive the structured UserProfile.
-    2. Use the 'Google Search Market Data' tool, passing the 'target_role' from the input.
-    3. Compare the user's skills against the market data found by the tool.
-    4. Identify the 'critical_skill_gap' (the most vital missing skills).
-    5. Output the result as a valid JSON object matching the MarketAnalysis schema.
-    """,
-    agent=market_analyst,
-    output_json=MarketAnalysis,
-    expected_output="A single, valid JSON object matching the MarketAnalysis schema."
-)
+# Prompt templates filled per profile (`{placeholders}`); CrewAI fills the task ones
+PROFILER_DESCRIPTION = """
+    Structure this user data as JSON matching {user_profile_schema}:
+    Skills: {current_skills}; Target Role: {target_role}; Experience: {years_of_experience} years.
+    """
 
-task_strategist = Task(
-    description=f"""
-    Execute the following steps sequentially:
-    1. Receive the MarketAnalysis JSON (Skill Gap, Salary, etc.).
-    2. Reference your internal Knowledge Base (specific courses listed in your system prompt).
-    3. Generate a highly detailed and motivational Career Roadmap Report in Markdown.
-    
-    The report MUST contain:
-    - **I. Executive Summary:** A 1-paragraph verdict (e.g., INVEST, HOLD).
-    - **II. Skill Gap Analysis Summary:** (Based on the Analyst's JSON).
-    - **III. Action Plan (Specific Steps):** A list of 3-5 concrete steps.
-    - **IV. Resource Recommendations:** Match the critical skill gaps to specific course names from your Knowledge Base (e.g., 'Advanced SQL Mastery for Data Science').
-    """,
-    agent=strategist_agent,
-    expected_output="A complete, well-formatted Markdown report (no JSON).",
-)
+ANALYST_DESCRIPTION = """
+    User profile: {user_profile}
+    1. Call 'Google Search Market Data' with the profile's target role.
+    2. Compare the user's skills with the market data.
+    3. Return the 1-3 most vital missing skills as 'critical_skill_gap' in JSON matching {market_analysis_schema}.
+    """
+
+REPORT_SECTIONS = """Write a Markdown career roadmap with these sections:
+    I. Executive Summary (one-word verdict such as INVEST or HOLD, plus 2 sentences)
+    II. Skill Gap Analysis Summary
+    III. Action Plan (3-5 steps)"""
+REPORT_OUTLINE = REPORT_SECTIONS + """
+    IV. Resource Recommendations"""
+
+STRATEGIST_DESCRIPTION = """
+    User profile: {user_profile}
+    MarketAnalysis: {market_analysis}
+    """ + REPORT_OUTLINE + """
+    Recommended resources:
+    {resources}
+    Keep it to at most 400 words, with no preamble and no JSON.
+    """
+
+COMBINED_DESCRIPTION = """
+    User profile: {user_profile}
+    Step 1: Call 'Google Search Market Data' with the profile's target role, compare the user's skills
+    with it and emit the 1-3 most vital missing skills as 'critical_skill_gap' in
+    <ANALYSIS>JSON matching {market_analysis_schema}</ANALYSIS>.
+    Step 2 (below that block): """ + REPORT_SECTIONS + """
+    Stop after section III; the resource recommendations are appended afterwards.
+    """
+
+def parse_profile(profile: dict) -> Optional[UserProfile]:
+    """Validate a complete profile, or return None for free-form input the Profiler must structure."""
+    if not all([profile.get("current_skills"), profile.get("target_role")]):
+        return None
+    try:
+        return USER_PROFILE_ADAPTER.validate_python(profile)
+    except ValidationError:
+        # e.g. years_of_experience given as "two" or "5+"
+        return None
+
+def build_inputs(profile: dict, user_profile: Optional[UserProfile]) -> dict:
+    """Fill the task templates for one profile, given its parse_profile() result."""
+    inputs = {
+        "current_skills": profile.get("current_skills") or "not provided",
+        "target_role": profile.get("target_role") or "not provided",
+        "years_of_experience": (
+            "unknown" if profile.get("years_of_experience") is None else profile["years_of_experience"]
+        ),
+        "user_profile_schema": USER_PROFILE_SCHEMA_JSON,
+        "market_analysis_schema": MARKET_ANALYSIS_SCHEMA_JSON,
+    }
+    if user_profile is None:
+        inputs["user_profile"] = (
+            f"Skills: {inputs['current_skills']}; Target Role: {inputs['target_role']}; "
+            f"Experience: {inputs['years_of_experience']} years."
+        )
+    else:
+        # Complete input is packed into the UserProfile schema directly;
+        # no LLM is needed for deterministic structuring.
+        inputs["user_profile"] = USER_PROFILE_ADAPTER.dump_json(user_profile).decode()
+    return inputs
+
+ANALYSIS_BLOCK = re.compile(r"<ANALYSIS>(.*?)</ANALYSIS>", re.DOTALL)
+JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+def extract_json(output: str) -> str:
+    """Strip any preamble or code fences around the JSON object in an agent's output."""
+    match = JSON_OBJECT.search(output)
+    return match.group(0) if match else output
+
+def to_market_analysis(output: str) -> MarketAnalysis:
+    """Parse and validate the Analyst's JSON output in one pass."""
+    return MARKET_ANALYSIS_ADAPTER.validate_json(extract_json(output))
+
+def split_combined_output(output: str) -> tuple:
+    """Split the combined agent's output into the validated MarketAnalysis and the Markdown report."""
+    match = ANALYSIS_BLOCK.search(output)
+    if match is None:
+        raise ValueError("Combined agent output is missing its <ANALYSIS> block.")
+    return to_market_analysis(match.group(1)), output[match.end():].strip()
+
+def select_resources(analysis: MarketAnalysis) -> str:
+    """Look up the Knowledge Base entries matching the skill gap."""
+    gap = analysis.critical_skill_gap.lower()
+    resources = dict.fromkeys(
+        resource for keyword, resource in KNOWLEDGE_BASE.items() if keyword in gap
+    )
+    if not resources:
+        return "- No matching course in the Knowledge Base yet."
+    return "\n".join(f"- {resource}" for resource in resources)
+
+def build_strategy_inputs(user_profile: str, analysis: MarketAnalysis) -> dict:
+    return {
+        "user_profile": user_profile,
+        "market_analysis": MARKET_ANALYSIS_ADAPTER.dump_json(analysis).decode(),
+        "resources": select_resources(analysis),
+    }
+
+# JSON task output is returned raw and validated by the TypeAdapters. The "no code
+# fences" instruction keeps it clean; extract_json tolerates the agent ignoring it.
+PROFILER_EXPECTED_OUTPUT = "A single, valid JSON object matching the UserProfile schema. Raw JSON only, no Markdown code fences."
+ANALYST_EXPECTED_OUTPUT = "A single, valid JSON object matching the MarketAnalysis schema. Raw JSON only, no Markdown code fences."
+COMBINED_EXPECTED_OUTPUT = "The <ANALYSIS> block with raw JSON, then a Markdown report of at most 400 words. No preamble."
 
 # --- 5. Crew Setup and Execution ---
 
-career_crew = Crew(
-    agents=[profiler_agent, market_analyst, strategist_agent],
-    tasks=[task_profiler, task_analyst, task_strategist],
-    process=Process.sequential,  # Ensures clean handoffs (A2A)
-    verbose=2, # High verbosity to show agent thinking and tool use
+# The Knowledge Base lookup runs in Python on the Analyst's output before the
+# Strategist is prompted.
+def build_analysis_crew() -> Crew:
+    """Analyst crew; kickoff_crew builds a fresh one for every run."""
+    market_analyst = build_market_analyst()
+    task_analyst = Task(
+        description=ANALYST_DESCRIPTION,
+        agent=market_analyst,
+        expected_output=ANALYST_EXPECTED_OUTPUT,
+    )
+    return Crew(
+        agents=[market_analyst],
+        tasks=[task_analyst],
+        process=Process.sequential,
+        verbose=2, # High verbosity to show agent thinking and tool use
+    )
+
+def build_combined_crew() -> Crew:
+    """Combined crew for complete profiles when FUSE_ANALYST_STRATEGIST is set."""
+    combined_agent = build_combined_agent()
+    task_combined = Task(
+        description=COMBINED_DESCRIPTION,
+        agent=combined_agent,
+        expected_output=COMBINED_EXPECTED_OUTPUT,
+    )
+    return Crew(
+        agents=[combined_agent],
+        tasks=[task_combined],
+        process=Process.sequential,
+        verbose=2,
+    )
+
+def build_profiler_crew() -> Crew:
+    """Free-form input path: structures the raw profile while the analysis crew runs alongside it."""
+    profiler_agent = build_profiler_agent()
+    task_profiler = Task(
+        description=PROFILER_DESCRIPTION,
+        agent=profiler_agent,
+        expected_output=PROFILER_EXPECTED_OUTPUT,
+    )
+    return Crew(
+        agents=[profiler_agent],
+        tasks=[task_profiler],
+        process=Process.sequential,
+        verbose=2,
+    )
+
+# Errors Gemini calls raise: google-genai for the direct calls, google.api_core and
+# langchain-google-genai for the crews' LangChain chat model.
+GEMINI_ERRORS = (APIError, GoogleAPIError, ChatGoogleGenerativeAIError)
+
+# Transient failures of the direct google-genai calls (rate limits, 5xx) are retried
+# with exponential backoff; anything else, such as a bad API key, surfaces immediately.
+# Crew runs are not wrapped: the LangChain chat model already retries each call itself.
+def _is_transient(error: BaseException) -> bool:
+    return isinstance(error, ServerError) or getattr(error, "code", None) == 429
+
+def _is_auth_error(error: BaseException) -> bool:
+    # 401/403, or the 400 "API key not valid" Gemini answers a bad key with
+    return getattr(error, "code", None) in (401, 403) or "API key" in str(error)
+
+gemini_retry = retry(
+    wait=wait_exponential(min=1, max=30),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception(_is_transient),
+    reraise=True,
 )
 
-# Exception handling for API key issues
-try:
-    print("--- Starting the Autonomous Career Guidance Agent ---")
-    
-    # Kick off the execution
-    final_result = career_crew.kickoff()
-    
-    print("\n" + "="*80)
-    print("FINAL CAREER ROADMAP REPORT GENERATED:")
-    print("="*80)
-    print(final_result)
-    print("="*80)
-
-except APIError as e:
-    print("\n" + "="*80)
-    print("FATAL ERROR: Gemini API Key Issue.")
-    print("Please ensure your GEMINI_API_KEY is correctly set in your .env file.")
-    print(f"Details: {e}")
-    print("="*80)
-except Exception as e:
-    print(f"\nAn unexpected error occurred: {e}")
\ No newline at end of file
+async def kickoff_crew(build_crew: Callable[[], Crew], inputs: dict):
+    """Run a freshly built crew for one set of inputs.
+
+    Failed LLM calls are retried inside the run by the chat model, so a run is never
+    repeated and turns that already succeeded are not billed again.
+    """
+    # Building is cheap and offline. Crew.copy() would drop each agent's llm and
+    # fall back to CrewAI's OpenAI default, so runs never share a copied crew.
+    async with gemini_slots():
+        return await build_crew().kickoff_async(inputs=inputs)
+
+async def analyse_profiles(profiles: list) -> list:
+    """Run every profile through its analysis crew(s), in input order.
+
+    Each result is either the Strategist inputs (a dict), the finished report for
+    profiles handled by the combined agent, or the error for a profile whose agent
+    output could not be parsed or whose Gemini calls kept failing.
+    """
+    async def analyse(index: int, profile: dict):
+        label = f"Profile {index + 1} ({profile.get('target_role')})"
+        try:
+            return await analyse_one(profile)
+        except GEMINI_ERRORS as error:
+            if _is_auth_error(error):
+                raise  # a rejected key fails every profile alike; main() reports it once
+            # Retries ran out for this profile only
+            return RuntimeError(f"{label}: {error}")
+        except ValueError as error:  # includes pydantic's ValidationError
+            # Malformed agent output only costs this profile its report
+            return ValueError(f"{label}: {error}")
+
+    async def analyse_one(profile: dict):
+        # Validated once; only free-form input (None) needs the Profiler LLM to structure it
+        user_profile = parse_profile(profile)
+        inputs = build_inputs(profile, user_profile)
+        if user_profile is None:
+            # Fan-out: the Profiler and Analyst run as separate crews, so a failure in
+            # either surfaces here instead of dying in a CrewAI worker thread.
+            raw_profile, output = await asyncio.gather(
+                kickoff_crew(build_profiler_crew, inputs), kickoff_crew(build_analysis_crew, inputs)
+            )
+            user_profile = USER_PROFILE_ADAPTER.validate_json(extract_json(raw_profile))
+            return build_strategy_inputs(
+                USER_PROFILE_ADAPTER.dump_json(user_profile).decode(), to_market_analysis(output)
+            )
+        if FUSE_ANALYST_STRATEGIST:
+            analysis, report = split_combined_output(await kickoff_crew(build_combined_crew, inputs))
+            # Section IV comes from the same Knowledge Base lookup as the Strategist's
+            return f"{report}\n\n## IV. Resource Recommendations\n{select_resources(analysis)}"
+        output = await kickoff_crew(build_analysis_crew, inputs)
+        return build_strategy_inputs(inputs["user_profile"], to_market_analysis(output))
+
+    # Every path is network-bound, so all profiles are in flight together, bounded by gemini_slots()
+    return await asyncio.gather(*(analyse(i, profile) for i, profile in enumerate(profiles)))
+
+@gemini_retry
+async def _open_report_stream(prompt: str):
+    """Send the Strategist request and return its stream, holding a gemini_slots() slot.
+
+    The caller releases the slot once the stream is drained. A failed attempt
+    releases it straight away, so backoff sleeps never hold a slot.
+    """
+    await gemini_slots().acquire()
+    try:
+        return await get_client().aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                system_instruction=STRATEGIST_INSTRUCTION,
+                # With automatic function calling on, the SDK only returns a lazy
+                # generator and the request would go out outside this retry
+                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+            ),
+        )
+    except BaseException:
+        gemini_slots().release()
+        raise
+
+async def stream_report(strategy_inputs: dict) -> str:
+    """Print the Strategist's report as it streams in and return the full text."""
+    chunks = []
+    stream = await _open_report_stream(STRATEGIST_DESCRIPTION.format(**strategy_inputs))
+    try:
+        async for chunk in stream:
+            if chunk.text:
+                print(chunk.text, end="", flush=True)
+                chunks.append(chunk.text)
+    finally:
+        gemini_slots().release()
+    print()
+    return "".join(chunks)
+
+async def main():
+    # Exception handling for API key issues
+    try:
+        print("--- Starting the Autonomous Career Guidance Agent ---")
+
+        # Kick off the execution
+        results = await analyse_profiles(USER_PROFILES)
+
+        # Reports are streamed one after another so their output does not interleave
+        for profile, result in zip(USER_PROFILES, results):
+            print("\n" + "="*80)
+            print(f"FINAL CAREER ROADMAP REPORT: {profile.get('target_role')}")
+            print("="*80)
+            if isinstance(result, dict):
+                try:
+                    await stream_report(result)
+                except APIError as error:
+                    if not _is_transient(error):
+                        raise  # e.g. a bad API key, which fails every report alike
+                    # Retries ran out for this report only; the others still get theirs
+                    print(f"\nCould not generate this report. {error}")
+            elif isinstance(result, Exception):
+                print(f"Could not generate this report. {result}")
+            else:
+                print(result)
+            print("="*80)
+
+    except GEMINI_ERRORS as e:
+        print("\n" + "="*80)
+        print("FATAL ERROR: Gemini API Key Issue.")
+        print("Please ensure your GEMINI_API_KEY is correctly set in your .env file.")
+        print(f"Details: {e}")
+        print("="*80)
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    # Load environment variables (for GEMINI_API_KEY)
+    load_dotenv()
+    asyncio.run(main())
@@ -0,0 +1,281 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import PermissionDenied, ResourceExhausted
+from google.genai.errors import ServerError
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+from tenacity import wait_none
+
+import agent_orchestrator
+from agent_orchestrator import (
+    DEFAULT_MARKET_DATA,
+    MARKET_DATA,
+    MarketAnalysis,
+    _fetch_market_data,
+    analyse_profiles,
+    build_analysis_crew,
+    extract_json,
+    get_agent_llm,
+    kickoff_crew,
+    main,
+    parse_profile,
+    select_resources,
+    split_combined_output,
+    stream_report,
+)
+
+ANALYSIS_JSON = (
+    '{"required_skills_found": "SQL", "critical_skill_gap": "SQL, Tableau",'
+    ' "average_salary_range": "$55,000 - $75,000"}'
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """Fresh cached LLM and limiter per test (each asyncio.run has its own loop), no backoff sleeps."""
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(agent_orchestrator._open_report_stream.retry, "wait", wait_none())
+    get_agent_llm.cache_clear()
+    agent_orchestrator.gemini_slots.cache_clear()
+    yield
+    get_agent_llm.cache_clear()
+    agent_orchestrator.gemini_slots.cache_clear()
+
+
+class FakeModels:
+    """Stands in for client.aio.models; fails the first `failures` requests with a 503."""
+
+    def __init__(self, chunks, failures=0, broken=False):
+        self.chunks, self.failures, self.broken = chunks, failures, broken
+        self.configs = []
+
+    async def generate_content_stream(self, model, contents, config):
+        self.configs.append(config)
+        if len(self.configs) <= self.failures:
+            raise ServerError(503, {"error": {"message": "unavailable"}})
+        return self._stream()
+
+    async def _stream(self):
+        for text in self.chunks:
+            yield SimpleNamespace(text=text)
+        if self.broken:
+            raise ConnectionError("stream dropped")
+
+
+def use_fake_models(monkeypatch, models):
+    monkeypatch.setattr(agent_orchestrator, "get_client", lambda: SimpleNamespace(aio=SimpleNamespace(models=models)))
+
+
+STRATEGY_INPUTS = {"user_profile": "{}", "market_analysis": ANALYSIS_JSON, "resources": "- SQL"}
+
+
+def make_analysis(gap: str) -> MarketAnalysis:
+    return MarketAnalysis(
+        required_skills_found="SQL", critical_skill_gap=gap, average_salary_range="$1"
+    )
+
+
+def test_select_resources_deduplicates_matches():
+    resources = select_resources(make_analysis("Data visualization (Tableau), SQL"))
+    assert resources.splitlines() == [
+        "- Advanced SQL Mastery for Data Science (Certification)",
+        "- Tableau Desktop Specialist Training (Course)",
+    ]
+
+
+def test_select_resources_without_match():
+    assert "No matching course" in select_resources(make_analysis("Negotiation"))
+
+
+def test_split_combined_output():
+    analysis, report = split_combined_output(
+        f"<ANALYSIS>{ANALYSIS_JSON}</ANALYSIS>\n## I. Executive Summary\nINVEST"
+    )
+    assert analysis.critical_skill_gap == "SQL, Tableau"
+    assert report == "## I. Executive Summary\nINVEST"
+
+
+def test_split_combined_output_tolerates_code_fence():
+    analysis, _ = split_combined_output(f"<ANALYSIS>```json\n{ANALYSIS_JSON}\n```</ANALYSIS>")
+    assert analysis.required_skills_found == "SQL"
+
+
+def test_split_combined_output_without_block():
+    with pytest.raises(ValueError):
+        split_combined_output("## I. Executive Summary\nINVEST")
+
+
+def test_extract_json_strips_preamble():
+    assert extract_json(f"Here is the analysis: {ANALYSIS_JSON}") == ANALYSIS_JSON
+
+
+@pytest.mark.parametrize(
+    "profile, needs_profiler",
+    [
+        ({"current_skills": "Python", "target_role": "Data Analyst", "years_of_experience": 2}, False),
+        ({"current_skills": "Python", "target_role": "Data Analyst", "years_of_experience": 0}, False),
+        ({"current_skills": "Python", "target_role": "Data Analyst", "years_of_experience": "two"}, True),
+        ({"current_skills": "Python", "target_role": "Data Analyst", "years_of_experience": "5+"}, True),
+        ({"current_skills": "Python", "target_role": "Data Analyst"}, True),
+        ({"current_skills": "", "target_role": "Data Analyst", "years_of_experience": 2}, True),
+    ],
+)
+def test_parse_profile_routes_free_form_input_to_the_profiler(profile, needs_profiler):
+    assert (parse_profile(profile) is None) is needs_profiler
+
+
+def test_fetch_market_data_exact_match():
+    assert _fetch_market_data("data analyst") == MARKET_DATA["data analyst"]
+
+
+def test_fetch_market_data_substring_match():
+    assert _fetch_market_data("junior data analyst") == MARKET_DATA["data analyst"]
+
+
+def test_fetch_market_data_default():
+    assert _fetch_market_data("astronaut") == DEFAULT_MARKET_DATA
+
+
+def test_kickoff_crew_runs_agents_on_gemini(monkeypatch):
+    ran = []
+
+    async def fake_kickoff(crew, inputs):
+        ran.append(crew)
+        return "done"
+
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", fake_kickoff)
+    assert asyncio.run(kickoff_crew(build_analysis_crew, {})) == "done"
+    [crew] = ran
+    assert all(agent.llm is get_agent_llm() for agent in crew.agents)
+    assert all(task.agent.llm is get_agent_llm() for task in crew.tasks)
+
+
+def test_kickoff_crew_does_not_repeat_a_failed_run(monkeypatch):
+    ran = []
+
+    async def failing_kickoff(crew, inputs):
+        ran.append(crew)
+        # What the chat model raises once its own retries are exhausted
+        raise ResourceExhausted("quota exceeded")
+
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", failing_kickoff)
+
+    async def run():
+        with pytest.raises(ResourceExhausted):
+            await kickoff_crew(build_analysis_crew, {})
+        return agent_orchestrator.gemini_slots()._value
+
+    assert asyncio.run(run()) == agent_orchestrator.MAX_PARALLEL_CREWS
+    assert len(ran) == 1
+
+
+def test_stream_report_retries_the_request_and_frees_its_slot(monkeypatch, capsys):
+    models = FakeModels(["## I. ", "INVEST"], failures=1)
+    use_fake_models(monkeypatch, models)
+
+    async def run():
+        report = await stream_report(STRATEGY_INPUTS)
+        return report, agent_orchestrator.gemini_slots()._value
+
+    report, free_slots = asyncio.run(run())
+    assert report == "## I. INVEST"
+    assert "## I. INVEST" in capsys.readouterr().out
+    assert len(models.configs) == 2
+    # The request must be sent by the retried await, not lazily on first iteration
+    assert all(config.automatic_function_calling.disable for config in models.configs)
+    assert free_slots == agent_orchestrator.MAX_PARALLEL_CREWS
+
+
+def test_stream_report_frees_its_slot_when_the_stream_breaks(monkeypatch):
+    use_fake_models(monkeypatch, FakeModels(["## I. "], broken=True))
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await stream_report(STRATEGY_INPUTS)
+        return agent_orchestrator.gemini_slots()._value
+
+    assert asyncio.run(run()) == agent_orchestrator.MAX_PARALLEL_CREWS
+
+
+def test_main_reports_a_rejected_key_from_the_crews(monkeypatch, capsys):
+    async def rejected(profiles):
+        raise ChatGoogleGenerativeAIError("Invalid argument provided to Gemini: 400 API key not valid.")
+
+    monkeypatch.setattr(agent_orchestrator, "analyse_profiles", rejected)
+    asyncio.run(main())
+    assert "Gemini API Key Issue" in capsys.readouterr().out
+
+
+def make_profile(role: str) -> dict:
+    return {"current_skills": "Python", "target_role": role, "years_of_experience": 2}
+
+
+def test_analyse_profiles_isolates_failures_per_profile(monkeypatch):
+    outputs = {
+        "Data Analyst": ANALYSIS_JSON,
+        "Software Engineer": "Sorry, I could not find any data.",
+    }
+    running = peak = 0
+
+    async def fake_kickoff(crew, inputs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        role = inputs["target_role"]
+        if role not in outputs:
+            raise ResourceExhausted("quota exceeded")
+        return outputs[role]
+
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", fake_kickoff)
+    roles = ["Data Analyst", "Software Engineer", "Astronaut"] + ["Data Analyst"] * 5
+    results = asyncio.run(analyse_profiles([make_profile(role) for role in roles]))
+
+    assert isinstance(results[0], dict) and "SQL" in results[0]["resources"]
+    assert isinstance(results[1], ValueError) and str(results[1]).startswith("Profile 2 (Software Engineer)")
+    assert isinstance(results[2], RuntimeError) and str(results[2]).startswith("Profile 3 (Astronaut)")
+    assert all(isinstance(result, dict) for result in results[3:])
+    assert peak == agent_orchestrator.MAX_PARALLEL_CREWS
+
+
+def test_analyse_profiles_raises_a_rejected_key(monkeypatch):
+    async def rejected(crew, inputs):
+        raise PermissionDenied("API key not valid")
+
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", rejected)
+    with pytest.raises(PermissionDenied):
+        asyncio.run(analyse_profiles([make_profile("Data Analyst")]))
+
+
+def test_analyse_profiles_validates_each_profile_once(monkeypatch):
+    parsed = []
+    real_parse_profile = agent_orchestrator.parse_profile
+
+    def counting_parse_profile(profile):
+        parsed.append(profile)
+        return real_parse_profile(profile)
+
+    async def fake_kickoff(crew, inputs):
+        return ANALYSIS_JSON
+
+    monkeypatch.setattr(agent_orchestrator, "parse_profile", counting_parse_profile)
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", fake_kickoff)
+    asyncio.run(analyse_profiles([make_profile("Data Analyst")]))
+    assert len(parsed) == 1
+
+
+def test_fused_report_gets_resources_from_the_parsed_analysis(monkeypatch):
+    async def fake_kickoff(crew, inputs):
+        return f"<ANALYSIS>```json\n{ANALYSIS_JSON}\n```</ANALYSIS>\n## I. Executive Summary\nINVEST"
+
+    monkeypatch.setattr(agent_orchestrator, "FUSE_ANALYST_STRATEGIST", True)
+    monkeypatch.setattr(agent_orchestrator.Crew, "kickoff_async", fake_kickoff)
+    [report] = asyncio.run(analyse_profiles([make_profile("Data Analyst")]))
+    assert report.startswith("## I. Executive Summary\nINVEST")
+    assert report.endswith(
+        "## IV. Resource Recommendations\n"
+        "- Advanced SQL Mastery for Data Science (Certification)\n"
+        "- Tableau Desktop Specialist Training (Course)"
+    )